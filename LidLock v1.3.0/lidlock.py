@@ -6,7 +6,11 @@ Copyright 2025 Saikat Roy
 Licensed under Apache License 2.0
 """
 
+import asyncio
+import cProfile
 import ctypes
+import functools
+import json
 import os
 import sys
 import uuid
@@ -29,6 +33,8 @@ import traceback
 import time
 import glob
 import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # WMI imports for hardware-level detection
 try:
@@ -39,10 +45,35 @@ except ImportError:
 
 # Constants
 APP_NAME = "LidLock"
-SINGLETON_IDENTIFIER = "Global\\{3DA16D16-5F02-4CFD-8C43-11C31127889D}"
+SINGLETON_IDENTIFIER = "Local\\{3DA16D16-5F02-4CFD-8C43-11C31127889D}"  # One lock agent per session
+ENGINE_IDENTIFIER = "Global\\{3DA16D16-5F02-4CFD-8C43-11C31127889D}"  # One detection engine per machine
+ENGINE_RECONNECT_DELAY = 2
+POLL_INTERVAL_AC = 2  # Seconds between lid samples on AC power
+POLL_INTERVAL_BATTERY = 5  # Reduced sampling budget on battery
+RESUME_SETTLE_DELAY = 0.5  # Confirm a "closed" reading this long after resume
+SUSPEND_FALLBACK_POLLS = 5  # Resume sampling after this many poll intervals if the wake broadcast is lost
+LOCK_GRACE_DELAY = 0.5  # Seconds between a confirmed lid close and the lock
+EXECUTOR_WORKERS = 1  # Threads for blocking Win32 calls made from the event loop
+TOAST_DURATION = 5  # Seconds a toast stays up - the next one waits for it
+SIMULATED_SAMPLE_COST = 0.02  # Seconds per display enumeration in --benchmark-power
+PROFILE_SAMPLE_WINDOW = 1000  # Recent call timings kept per function for percentiles
 AUTOSTART_NAME = "LidLock"  # Shows as "LidLock" in Task Manager Startup
 VERSION = "1.3.0"
 
+# Display topology
+DISPLAY_DEVICE_ACTIVE = 0x00000001
+DISPLAY_DEVICE_PRIMARY_DEVICE = 0x00000004
+EDD_GET_DEVICE_INTERFACE_NAME = 0x00000001
+INTERNAL_OUTPUT_TECHNOLOGIES = (6, 11, 13, 0x80000000)  # LVDS, embedded DP, embedded UDI, internal
+TOPOLOGY_INTERNAL_OFF = "internal_panel_off"
+TOPOLOGY_INTERNAL_ON = "internal_panel_on"
+TOPOLOGY_EXTERNAL_ADDED = "external_added"
+TOPOLOGY_EXTERNAL_REMOVED = "external_removed"
+TOPOLOGY_DOCK_ATTACH = "dock_attach"
+TOPOLOGY_DOCK_DETACH = "dock_detach"
+TOPOLOGY_EVENTS = (TOPOLOGY_INTERNAL_OFF, TOPOLOGY_INTERNAL_ON, TOPOLOGY_EXTERNAL_ADDED,
+                   TOPOLOGY_EXTERNAL_REMOVED, TOPOLOGY_DOCK_ATTACH, TOPOLOGY_DOCK_DETACH)
+
 # GUIDs for power settings
 GUID_CONSOLE_DISPLAY_STATE = "{6FE69556-704A-47A0-8F24-C28D936FDA47}"
 GUID_LIDSWITCH_STATE_CHANGE = "{BA3E0F4D-B817-4094-A2D1-D56379E6A0F3}"
@@ -122,6 +153,145 @@ logging.info(f"Current log: {log_path}")
 # ============================================
 
 
+# ============================================
+# PROFILING - OFF BY DEFAULT
+# ============================================
+class Profiler:
+    """
+    Per-function cost accounting for the hot path
+    Enable at runtime from the tray, with --profile or LIDLOCK_PROFILE=1
+    While disabled a profiled call costs a single flag check
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.cprofile = None
+        self.cprofile_lock = threading.Lock()
+        self.started = None
+    
+    def enable(self):
+        """Start timing profiled functions and logging calls, and capture a cProfile"""
+        if self.enabled:
+            return
+        with self.stats_lock:
+            self.stats = {}
+        with self.cprofile_lock:
+            self.cprofile = cProfile.Profile()
+        self.started = time.time()
+        
+        # Time every record the root logger hands to its handlers (file + console)
+        root = logging.getLogger()
+        root.handle = profiled(logging.Logger.handle.__get__(root), name="logging")
+        
+        self.enabled = True
+        logging.info("⏱️ Profiling enabled")
+    
+    def disable(self):
+        """Stop profiling - collected stats are kept until the next enable()"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        root = logging.getLogger()
+        if "handle" in vars(root):
+            del root.handle
+        logging.info("⏱️ Profiling disabled")
+    
+    def record(self, name, elapsed):
+        with self.stats_lock:
+            entry = self.stats.get(name)
+            if entry is None:
+                entry = self.stats[name] = {
+                    'calls': 0,
+                    'total': 0.0,
+                    'recent': deque(maxlen=PROFILE_SAMPLE_WINDOW),
+                }
+            entry['calls'] += 1
+            entry['total'] += elapsed
+            entry['recent'].append(elapsed)
+    
+    def run(self, func, *args):
+        """Call func under the cProfile capture when one is active"""
+        if not self.enabled:
+            return func(*args)
+        with self.cprofile_lock:
+            if self.cprofile is None:
+                return func(*args)
+            return self.cprofile.runcall(func, *args)
+    
+    def report(self):
+        """Per-function call counts, cumulative time and percentiles (ms)"""
+        def percentile(recent, p):
+            return recent[min(len(recent) - 1, int(p * len(recent)))] * 1000
+        
+        lines = [f"{'function':<30}{'calls':>8}{'total':>12}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}"]
+        with self.stats_lock:
+            entries = sorted(self.stats.items(), key=lambda item: item[1]['total'], reverse=True)
+            for name, entry in entries:
+                recent = sorted(entry['recent'])
+                lines.append(
+                    f"{name:<30}{entry['calls']:>8}{entry['total'] * 1000:>12.2f}"
+                    f"{entry['total'] * 1000 / entry['calls']:>10.3f}"
+                    f"{percentile(recent, 0.50):>10.3f}{percentile(recent, 0.95):>10.3f}"
+                    f"{percentile(recent, 0.99):>10.3f}"
+                )
+        return "\n".join(lines)
+    
+    def dump(self):
+        """
+        Write the timing report and the cProfile capture (pstats format) to the log folder
+        Returns: list of written file paths
+        """
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(log_dir, f"lidlock_profile_{os.getpid()}_{stamp}")
+        written = []
+        
+        try:
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(f"LidLock v{VERSION} profile - pid {os.getpid()}\n")
+                if self.started:
+                    f.write(f"Profiling since {time.ctime(self.started)}\n")
+                f.write("Times in milliseconds\n\n")
+                f.write(self.report() + "\n")
+            written.append(base + ".txt")
+            
+            with self.cprofile_lock:
+                if self.cprofile is not None:
+                    self.cprofile.dump_stats(base + ".prof")
+                    written.append(base + ".prof")
+        except Exception as e:
+            logging.error(f"Error writing profile: {e}")
+        
+        for path in written:
+            logging.info(f"⏱️ Profile written: {path}")
+        return written
+
+
+PROFILER = Profiler()
+
+
+def profiled(func=None, name=None):
+    """Decorator timing calls into PROFILER - near-zero overhead while profiling is off"""
+    if func is None:
+        return functools.partial(profiled, name=name)
+    name = name or func.__name__
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILER.enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            PROFILER.record(name, time.perf_counter() - start)
+    
+    return wrapper
+
+# ============================================
+
+
 class POWERBROADCAST_SETTING(ctypes.Structure):
     """Structure for power broadcast settings"""
     _fields_ = [
@@ -213,33 +383,7 @@ def get_monitor_count_via_user32():
         return 0
 
 
-def is_laptop_lid_closed():
-    """
-    Determine if laptop lid is closed using multiple methods
-    Returns: True if lid is closed, False if open, None if unknown
-    """
-    try:
-        display_cnt = display_count()
-        monitor_cnt = get_monitor_count_via_user32()
-        
-        logging.debug(f"Display check - EnumDisplayDevices: {display_cnt}, GetSystemMetrics: {monitor_cnt}")
-        
-        if display_cnt == 0 and monitor_cnt <= 1:
-            logging.info("Lid likely closed (no active displays)")
-            return True
-        
-        if display_cnt > 0 or monitor_cnt > 1:
-            logging.info(f"Lid open or external displays ({display_cnt} displays)")
-            return False
-        
-        return None
-        
-    except Exception as e:
-        logging.error(f"Error checking lid state: {e}")
-        logging.error(traceback.format_exc())
-        return None
-
-
+@profiled
 def lock_workstation():
     """Lock the Windows workstation"""
     try:
@@ -256,10 +400,30 @@ def lock_workstation():
         return False
 
 
-def is_session_locked():
-    """Check if the current session is locked"""
+def get_current_session_id():
+    """Get the Terminal Services session this process runs in"""
+    try:
+        return win32ts.ProcessIdToSessionId(os.getpid())
+    except Exception as e:
+        logging.error(f"Error getting current session id: {e}")
+        return None
+
+
+def is_console_session(session_id):
+    """Check if a session owns the physical console (screen, keyboard, lid)"""
+    try:
+        return session_id == win32ts.WTSGetActiveConsoleSessionId()
+    except Exception as e:
+        logging.error(f"Error checking console session: {e}")
+        return False
+
+
+@profiled
+def is_session_locked(session_id=None):
+    """Check if a session is locked (defaults to the active console session)"""
     try:
-        session_id = win32ts.WTSGetActiveConsoleSessionId()
+        if session_id is None:
+            session_id = win32ts.WTSGetActiveConsoleSessionId()
         session_info = win32ts.WTSQuerySessionInformation(
             win32ts.WTS_CURRENT_SERVER_HANDLE,
             session_id,
@@ -271,72 +435,879 @@ def is_session_locked():
         return False
 
 
-class LidMonitorPolling(threading.Thread):
+def normalize_display_id(device_id):
+    """
+    Reduce a monitor ID to its hardware path, e.g. DISPLAY\\LGD05E5\\4&2A1C6E0C&0&UID265988
+    Accepts device interface paths (\\\\?\\DISPLAY#...#{guid}) and WMI instance names (..._0)
+    """
+    if not device_id:
+        return None
+    device_id = device_id.upper()
+    if device_id.startswith("\\\\?\\"):
+        device_id = "\\".join(device_id[4:].split("#")[:3])
+    head, sep, tail = device_id.rpartition("_")
+    if sep and tail.isdigit():
+        device_id = head
+    return device_id
+
+
+@profiled
+def get_internal_display_ids():
+    """
+    Hardware IDs of built-in panels, from WMI connection parameters
+    Returns: set of normalized IDs, or None if WMI can't tell
+    """
+    if not WMI_AVAILABLE:
+        return None
+    try:
+        import pythoncom
+        pythoncom.CoInitialize()  # Called from executor threads
+        connection = wmi.WMI(namespace="root\\wmi")
+        internal_ids = set()
+        for params in connection.WmiMonitorConnectionParams():
+            if (params.VideoOutputTechnology & 0xFFFFFFFF) in INTERNAL_OUTPUT_TECHNOLOGIES:
+                internal_ids.add(normalize_display_id(params.InstanceName))
+        logging.info(f"Internal panels (WMI): {sorted(internal_ids)}")
+        return internal_ids
+    except Exception as e:
+        logging.error(f"Error querying internal panels via WMI: {e}")
+        return None
+
+
+@profiled
+def get_display_topology():
+    """
+    Snapshot of every monitor, keyed by its stable device ID
+    Returns: {device_id: {'name', 'active', 'primary', 'internal'}}
+    """
+    topology = {}
+    try:
+        from win32api import EnumDisplayDevices
+        device_index = 0
+        
+        while True:
+            try:
+                adapter = EnumDisplayDevices(None, device_index)
+            except:
+                break
+            if not adapter.DeviceName:
+                break
+            
+            monitor_index = 0
+            while True:
+                try:
+                    monitor = EnumDisplayDevices(adapter.DeviceName, monitor_index, EDD_GET_DEVICE_INTERFACE_NAME)
+                except:
+                    break
+                if not monitor.DeviceName:
+                    break
+                
+                device_id = normalize_display_id(monitor.DeviceID) or monitor.DeviceName
+                active = bool(adapter.StateFlags & DISPLAY_DEVICE_ACTIVE
+                              and monitor.StateFlags & DISPLAY_DEVICE_ACTIVE)
+                primary = bool(adapter.StateFlags & DISPLAY_DEVICE_PRIMARY_DEVICE)
+                
+                # The same monitor can show up under several adapters (hybrid
+                # graphics) - it counts as active if any of them drives it
+                entry = topology.get(device_id)
+                if entry is not None:
+                    entry['active'] = entry['active'] or active
+                    entry['primary'] = entry['primary'] or primary
+                else:
+                    topology[device_id] = {
+                        'name': monitor.DeviceString,
+                        'active': active,
+                        'primary': primary,
+                        'internal': False,
+                    }
+                monitor_index += 1
+            
+            device_index += 1
+    except Exception as e:
+        logging.error(f"Error reading display topology: {e}")
+    return topology
+
+
+def diff_topology(old, new):
+    """
+    Minimal diff between two snapshots - only monitors whose presence or
+    active state changed
+    Returns: list of (kind, device_id, monitor) with kind in
+    'added', 'removed', 'activated', 'deactivated'
+    """
+    changes = []
+    for device_id, monitor in new.items():
+        before = old.get(device_id)
+        if before is None:
+            changes.append(('added', device_id, monitor))
+        elif before['active'] != monitor['active']:
+            changes.append(('activated' if monitor['active'] else 'deactivated', device_id, monitor))
+    for device_id, monitor in old.items():
+        if device_id not in new:
+            changes.append(('removed', device_id, monitor))
+    return changes
+
+
+def classify_topology_changes(changes):
+    """
+    Turn a topology diff into events: internal panel off/on, external
+    added/removed, and dock attach/detach (2+ externals at once)
+    """
+    events = []
+    externals_up = 0
+    externals_down = 0
+    
+    for kind, device_id, monitor in changes:
+        came_up = kind == 'activated' or (kind == 'added' and monitor['active'])
+        went_down = kind == 'deactivated' or (kind == 'removed' and monitor['active'])
+        
+        if monitor['internal']:
+            if came_up:
+                events.append(TOPOLOGY_INTERNAL_ON)
+            elif went_down:
+                events.append(TOPOLOGY_INTERNAL_OFF)
+        elif came_up:
+            externals_up += 1
+        elif went_down:
+            externals_down += 1
+    
+    if externals_up:
+        events.append(TOPOLOGY_DOCK_ATTACH if externals_up > 1 else TOPOLOGY_EXTERNAL_ADDED)
+    if externals_down:
+        events.append(TOPOLOGY_DOCK_DETACH if externals_down > 1 else TOPOLOGY_EXTERNAL_REMOVED)
+    return events
+
+
+class TopologyTracker:
+    """
+    Lid detection from display topology diffs
+    Keeps the previous snapshot and only re-decides when monitors change, so
+    a lock decision never needs a second enumeration; each change is also
+    classified (panel off, dock detach...) for the log and the lock agent
+    """
+    
+    def __init__(self, topology_source=get_display_topology, internal_source=get_internal_display_ids,
+                 power_source=get_battery_status):
+        self.topology_source = topology_source
+        self.internal_source = internal_source
+        self.power_source = power_source
+        self.wmi_ids = None
+        self.internal_ids = None
+        self.desktop = None
+        self.snapshot = None
+        self.lid_closed = None
+        self.last_events = []
+    
+    def mark_internal(self, snapshot):
+        # WMI can miss a panel that is off at startup - ask again whenever a
+        # monitor appears, until it names one
+        if not self.wmi_ids and (self.snapshot is None or snapshot.keys() - self.snapshot.keys()):
+            self.wmi_ids = self.internal_source() or None
+            if self.wmi_ids:
+                self.internal_ids = self.wmi_ids
+        if self.internal_ids is None:
+            # No answer from WMI - laptops boot on the built-in panel, so take
+            # the active monitor(s) on the primary adapter
+            primary_ids = {
+                device_id for device_id, monitor in snapshot.items()
+                if monitor['primary'] and monitor['active']
+            }
+            if primary_ids:
+                self.internal_ids = primary_ids
+                logging.info(f"Internal panels (primary adapter): {sorted(self.internal_ids)}")
+        for device_id, monitor in snapshot.items():
+            monitor['internal'] = device_id in (self.internal_ids or ())
+    
+    def is_desktop(self):
+        """Only a machine that reports no system battery is treated as lidless"""
+        if self.desktop is None:
+            battery = self.power_source()
+            self.desktop = battery is not None and not battery.get('battery_present', True)
+            if self.desktop:
+                logging.info("No system battery - display changes are never treated as a lid close")
+        return self.desktop
+    
+    @profiled(name="TopologyTracker.sample")
+    def sample(self):
+        """
+        Returns: True if the lid is closed with nothing else to show on
+        (lock), False otherwise
+        """
+        snapshot = self.topology_source()
+        self.mark_internal(snapshot)
+        
+        events = []
+        if self.snapshot is not None:
+            changes = diff_topology(self.snapshot, snapshot)
+            if not changes:
+                self.last_events = []
+                return self.lid_closed
+            events = classify_topology_changes(changes)
+            logging.info(f"Display topology changed: {', '.join(events) or 'inactive monitors only'}")
+        
+        self.snapshot = snapshot
+        self.last_events = events
+        logging.debug(f"Display topology: {json.dumps(snapshot)}")
+        
+        # Internal panel off (or gone) and no external monitor keeping the
+        # session in use - clamshell mode on a dock stays unlocked
+        active = any(monitor['active'] for monitor in snapshot.values())
+        self.lid_closed = not active and not self.is_desktop()
+        return self.lid_closed
+
+
+def trace_snapshot(internal=True, externals=(), internal_id="DISPLAY\\LGD05E5\\4&2A1C6E0C&0&UID265988"):
+    """Build a raw trace snapshot: internal True/False (on/off) or None (gone)"""
+    snapshot = {}
+    if internal is not None:
+        snapshot[internal_id] = {'name': "Built-in panel", 'active': internal, 'primary': True, 'internal': False}
+    for device_id in externals:
+        snapshot[device_id] = {'name': "External monitor", 'active': True, 'primary': False, 'internal': False}
+    return snapshot
+
+
+DOCK_INTERNAL = "DISPLAY\\LGD05E5\\4&2A1C6E0C&0&UID265988"
+DOCK_EXTERNAL_1 = "DISPLAY\\DELA0B1\\5&1B2C3D4E&0&UID4352"
+DOCK_EXTERNAL_2 = "DISPLAY\\DELA0B1\\5&1B2C3D4E&0&UID4353"
+
+# Hand-labelled traces: 'lid_closed' is whether LidLock should lock at that
+# step, 'events' the expected classification; 'internal_ids' stands in for
+# the WMI answer (None - no WMI, use the primary adapter) and can be given
+# per step, 'battery_present' for the battery check (missing - unknown)
+DOCK_TRACES = [
+    {'name': "lid close undocked", 'internal_ids': None, 'steps': [
+        {'snapshot': trace_snapshot(True), 'lid_closed': False, 'events': []},
+        {'snapshot': trace_snapshot(False), 'lid_closed': True, 'events': [TOPOLOGY_INTERNAL_OFF]},
+        {'snapshot': trace_snapshot(True), 'lid_closed': False, 'events': [TOPOLOGY_INTERNAL_ON]},
+    ]},
+    {'name': "panel drops out of enumeration", 'internal_ids': None, 'steps': [
+        {'snapshot': trace_snapshot(True), 'lid_closed': False, 'events': []},
+        {'snapshot': trace_snapshot(None), 'lid_closed': True, 'events': [TOPOLOGY_INTERNAL_OFF]},
+    ]},
+    {'name': "dock, clamshell, undock", 'internal_ids': None, 'steps': [
+        {'snapshot': trace_snapshot(True), 'lid_closed': False, 'events': []},
+        {'snapshot': trace_snapshot(True, [DOCK_EXTERNAL_1, DOCK_EXTERNAL_2]), 'lid_closed': False,
+         'events': [TOPOLOGY_DOCK_ATTACH]},
+        {'snapshot': trace_snapshot(False, [DOCK_EXTERNAL_1, DOCK_EXTERNAL_2]), 'lid_closed': False,
+         'events': [TOPOLOGY_INTERNAL_OFF]},
+        {'snapshot': trace_snapshot(False), 'lid_closed': True, 'events': [TOPOLOGY_DOCK_DETACH]},
+    ]},
+    {'name': "single monitor hotplug", 'internal_ids': None, 'steps': [
+        {'snapshot': trace_snapshot(True), 'lid_closed': False, 'events': []},
+        {'snapshot': trace_snapshot(True, [DOCK_EXTERNAL_1]), 'lid_closed': False,
+         'events': [TOPOLOGY_EXTERNAL_ADDED]},
+        {'snapshot': trace_snapshot(True, [DOCK_EXTERNAL_1]), 'lid_closed': False, 'events': []},
+        {'snapshot': trace_snapshot(True), 'lid_closed': False, 'events': [TOPOLOGY_EXTERNAL_REMOVED]},
+    ]},
+    {'name': "start with lid closed, then dock", 'internal_ids': [DOCK_INTERNAL], 'steps': [
+        {'snapshot': trace_snapshot(False), 'lid_closed': True, 'events': []},
+        {'snapshot': trace_snapshot(False, [DOCK_EXTERNAL_1, DOCK_EXTERNAL_2]), 'lid_closed': False,
+         'events': [TOPOLOGY_DOCK_ATTACH]},
+        {'snapshot': trace_snapshot(True, [DOCK_EXTERNAL_1, DOCK_EXTERNAL_2]), 'lid_closed': False,
+         'events': [TOPOLOGY_INTERNAL_ON]},
+    ]},
+    {'name': "start docked with lid closed, WMI silent", 'internal_ids': [], 'steps': [
+        {'snapshot': trace_snapshot(None, [DOCK_EXTERNAL_1]), 'lid_closed': False, 'events': []},
+        {'snapshot': trace_snapshot(True, [DOCK_EXTERNAL_1]), 'lid_closed': False,
+         'events': [TOPOLOGY_INTERNAL_ON]},
+        {'snapshot': trace_snapshot(True), 'lid_closed': False, 'events': [TOPOLOGY_EXTERNAL_REMOVED]},
+        {'snapshot': trace_snapshot(False), 'lid_closed': True, 'events': [TOPOLOGY_INTERNAL_OFF]},
+    ]},
+    {'name': "WMI names the panel once it is on", 'internal_ids': [], 'steps': [
+        {'snapshot': trace_snapshot(None, [DOCK_EXTERNAL_1]), 'lid_closed': False, 'events': []},
+        {'snapshot': trace_snapshot(True, [DOCK_EXTERNAL_1]), 'internal_ids': [DOCK_INTERNAL],
+         'lid_closed': False, 'events': [TOPOLOGY_INTERNAL_ON]},
+        {'snapshot': trace_snapshot(False), 'lid_closed': True,
+         'events': [TOPOLOGY_INTERNAL_OFF, TOPOLOGY_EXTERNAL_REMOVED]},
+    ]},
+    {'name': "desktop monitor switched off", 'internal_ids': None, 'battery_present': False, 'steps': [
+        {'snapshot': trace_snapshot(None, [DOCK_EXTERNAL_1]), 'lid_closed': False, 'events': []},
+        {'snapshot': trace_snapshot(None), 'lid_closed': False, 'events': [TOPOLOGY_EXTERNAL_REMOVED]},
+    ]},
+]
+
+
+def load_dock_traces(path):
+    """Load traces (same layout as DOCK_TRACES) from a JSON file written by record_dock_trace"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_dock_trace(path, name="recorded"):
+    """
+    Record a labelled dock trace on this machine for --benchmark-topology
+    Each step takes a real topology snapshot and WMI answer; the user says
+    whether LidLock should lock at that point and which changes just
+    happened, and the trace is appended to the JSON file
+    """
+    battery = get_battery_status()
+    trace = {'name': name, 'internal_ids': None, 'steps': []}
+    if battery is not None:
+        trace['battery_present'] = battery['battery_present']
+    
+    print("Change the setup (close the lid, plug in a dock...), then answer each step.")
+    print("Events: " + ", ".join(f"{index} = {event}" for index, event in enumerate(TOPOLOGY_EVENTS, 1)))
+    while True:
+        answer = input(f"Step {len(trace['steps']) + 1} - Enter = should not lock, c = should lock, q = save: ")
+        answer = answer.strip().lower()
+        if answer == "q":
+            break
+        internal_ids = get_internal_display_ids()
+        step = {
+            'snapshot': get_display_topology(),
+            'internal_ids': sorted(internal_ids) if internal_ids is not None else None,
+            'lid_closed': answer == "c",
+            'events': [],
+        }
+        
+        if trace['steps']:
+            while True:
+                numbers = input("  Events since the last step (e.g. 1,6 - Enter = none): ").replace(" ", "")
+                try:
+                    step['events'] = [TOPOLOGY_EVENTS[int(number) - 1] for number in numbers.split(",") if number]
+                    break
+                except (ValueError, IndexError):
+                    print(f"  Use numbers 1-{len(TOPOLOGY_EVENTS)}")
+        trace['steps'].append(step)
+    
+    traces = load_dock_traces(path) if os.path.exists(path) else []
+    traces.append(trace)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(traces, f, indent=2)
+    print(f"Saved {len(trace['steps'])} step(s) to {path}")
+
+
+def replay_trace(trace):
+    """
+    Feed a trace through a fresh TopologyTracker
+    Returns: [(lid_closed, events)] for every step
+    """
+    current = {}
+    
+    def next_snapshot():
+        current['step'] = next(steps)
+        return {device_id: dict(monitor) for device_id, monitor in current['step']['snapshot'].items()}
+    
+    def internal_source():
+        internal_ids = current['step'].get('internal_ids', trace.get('internal_ids'))
+        return set(internal_ids) if internal_ids is not None else None
+    
+    def power_source():
+        if 'battery_present' not in trace:
+            return None
+        return {'battery_present': trace['battery_present']}
+    
+    steps = iter(trace['steps'])
+    tracker = TopologyTracker(next_snapshot, internal_source, power_source)
+    return [(tracker.sample(), tracker.last_events) for _ in trace['steps']]
+
+
+def benchmark_topology_diff(traces=DOCK_TRACES, repeat=1000):
+    """
+    Lock decision accuracy and per-sample cost over labelled dock traces
+    Every trace is replayed `repeat` times through TopologyTracker - internal
+    panel marking, diff, classification and lock decision
+    """
+    timings = []
+    decisions = correct = 0
+    classified = classified_correct = 0
+    
+    # Replays log every topology change - keep that out of the timings
+    logging.disable(logging.INFO)
+    try:
+        for trace in traces:
+            steps = trace.get('steps') or []
+            if not steps:
+                continue
+            
+            start = time.perf_counter()
+            for _ in range(repeat):
+                results = replay_trace(trace)
+            timings.append((time.perf_counter() - start) / (repeat * len(steps)) * 1e6)
+            
+            for index, (step, (lid_closed, events)) in enumerate(zip(steps, results)):
+                if 'lid_closed' in step:
+                    decisions += 1
+                    if lid_closed == step['lid_closed']:
+                        correct += 1
+                    else:
+                        print(f"Wrong lock decision in '{trace.get('name')}' step {index + 1}: "
+                              f"{lid_closed} (expected {step['lid_closed']})")
+                if 'events' in step:
+                    classified += 1
+                    if sorted(events) == sorted(step['events']):
+                        classified_correct += 1
+                    else:
+                        print(f"Misclassified in '{trace.get('name')}' step {index + 1}: "
+                              f"{events} (expected {step['events']})")
+    finally:
+        logging.disable(logging.NOTSET)
+    
+    results = {
+        'traces': len(timings),
+        'decisions': decisions,
+        'decision_accuracy_percent': correct / decisions * 100 if decisions else None,
+        'classification_accuracy_percent': classified_correct / classified * 100 if classified else None,
+        'sample_us_avg': sum(timings) / len(timings) if timings else None,
+        'sample_us_max': max(timings) if timings else None,
+    }
+    for name, value in results.items():
+        if value is None:
+            print(f"{name}: n/a")
+        elif isinstance(value, float):
+            print(f"{name}: {value:.2f}")
+        else:
+            print(f"{name}: {value}")
+    return results
+
+
+class LidMonitorPolling:
     """
     Polling-based lid monitor for systems where power notifications don't work
     This is the MAIN METHOD for virtualization-enabled systems
+    Power-aware: idle while suspended, samples at once on resume, slows down on battery
+    Runs as a coroutine on the runtime loop - sampler calls go through run_blocking
     """
     
-    def __init__(self, callback):
-        super().__init__(daemon=True)
+    def __init__(self, callback, run_blocking, sampler, gate=None, on_gate_closed=None):
         self.callback = callback
+        self.run_blocking = run_blocking
+        self.sampler = sampler
+        self.gate = gate
+        self.on_gate_closed = on_gate_closed
         self.running = True
         self.last_state = None
-        self.poll_interval = 2
+        self.poll_interval = POLL_INTERVAL_AC
+        self.on_battery = False
+        self.suspended = False
+        self.resume_pending = False
+        self.suspend_time = None
+        self.resume_time = None
+        self.wake_event = asyncio.Event()
+        self.stats = {
+            'samples': 0,
+            'battery_samples': 0,
+            'suspends': 0,
+            'resumes': 0,
+            'suspended_seconds': 0.0,
+            'last_resume_latency_ms': None,
+        }
         
-    def run(self):
+    async def run(self):
         logging.info("✅ Starting polling-based lid monitor (virtualization-compatible)")
-        print("✅ Polling monitor started - checking lid every 2 seconds")
+        print(f"✅ Polling monitor started - checking lid every {self.poll_interval} seconds")
         
         while self.running:
             try:
-                lid_closed = is_laptop_lid_closed()
-                
-                if lid_closed is not None and lid_closed != self.last_state:
-                    logging.info(f"Lid state changed: {self.last_state} -> {lid_closed}")
-                    
-                    if lid_closed and not is_session_locked():
-                        logging.info("🔒 Lid closed detected via polling - triggering lock")
-                        print("🔒 Lid closed - locking workstation!")
-                        self.callback()
-                    
-                    self.last_state = lid_closed
-                
-                time.sleep(self.poll_interval)
-                
+                if not self.suspended:
+                    await self.sample()
             except Exception as e:
-                logging.error(f"Error in polling thread: {e}")
+                logging.error(f"Error in polling monitor: {e}")
                 logging.error(traceback.format_exc())
-                time.sleep(self.poll_interval)
+            
+            # Sleep until the next poll, or a few polls while suspended;
+            # resume() and power source changes cut the wait short
+            try:
+                await asyncio.wait_for(
+                    self.wake_event.wait(),
+                    self.poll_interval * (SUSPEND_FALLBACK_POLLS if self.suspended else 1)
+                )
+            except asyncio.TimeoutError:
+                if self.suspended:
+                    # The loop only runs while the system is awake - the resume broadcast was lost
+                    logging.warning("No resume notification received - resuming lid sampling")
+                    self.resume()
+            self.wake_event.clear()
+    
+    def gated_sample(self):
+        """Gate check and lid sample together - one executor call per poll"""
+        if self.gate is not None and not self.gate():
+            return False, None
+        return True, self.sampler()
+    
+    async def take_sample(self):
+        """Returns: (gate open, lid state)"""
+        gate_open, lid_closed = await self.run_blocking(PROFILER.run, self.gated_sample)
+        if gate_open:
+            self.stats['samples'] += 1
+        elif self.on_gate_closed:
+            self.on_gate_closed()
+        return gate_open, lid_closed
+    
+    async def sample(self):
+        """Take one lid sample and report state transitions"""
+        resumed = self.resume_pending
+        self.resume_pending = False
+        
+        gate_open, lid_closed = await self.take_sample()
+        if not gate_open:
+            return
+        if self.on_battery:
+            self.stats['battery_samples'] += 1
+        
+        if resumed:
+            latency_ms = (time.monotonic() - self.resume_time) * 1000
+            self.stats['last_resume_latency_ms'] = latency_ms
+            logging.info(f"Resume sample taken after {latency_ms:.1f} ms")
+            
+            # Displays can still be powering up right after resume - confirm a
+            # closed reading before acting on it
+            if lid_closed and lid_closed != self.last_state:
+                await asyncio.sleep(RESUME_SETTLE_DELAY)
+                gate_open, lid_closed = await self.take_sample()
+                if not gate_open:
+                    return
+        
+        if lid_closed is not None and lid_closed != self.last_state:
+            logging.info(f"Lid state changed: {self.last_state} -> {lid_closed}")
+            self.last_state = lid_closed
+            self.callback(lid_closed)
+                
+    def suspend(self):
+        """Stop sampling while the system sleeps or hibernates"""
+        if self.suspended:
+            return
+        self.suspended = True
+        self.suspend_time = time.monotonic()
+        self.stats['suspends'] += 1
+        logging.info("💤 System suspending - lid sampling paused")
+        # Restart the wait so the lost-resume fallback counts from now
+        self.wake_event.set()
+                
+    def resume(self):
+        """Take a prioritized sample as soon as the system wakes up"""
+        # A user wake sends both PBT_APMRESUMEAUTOMATIC and PBT_APMRESUMESUSPEND
+        if not self.suspended:
+            return
+        self.resume_time = time.monotonic()
+        if self.suspend_time is not None:
+            self.stats['suspended_seconds'] += self.resume_time - self.suspend_time
+        self.suspended = False
+        self.resume_pending = True
+        self.stats['resumes'] += 1
+        logging.info("⏰ System resumed - sampling lid state now")
+        self.wake_event.set()
+    
+    def set_power_source(self, ac_online):
+        """Use the full sampling budget on AC and a reduced one on battery"""
+        on_battery = not ac_online
+        if on_battery == self.on_battery:
+            return
+        self.on_battery = on_battery
+        self.poll_interval = POLL_INTERVAL_BATTERY if on_battery else POLL_INTERVAL_AC
+        logging.info(f"🔋 Power source: {'battery' if on_battery else 'AC'} - "
+                     f"polling every {self.poll_interval} seconds")
+        self.wake_event.set()
     
     def stop(self):
         self.running = False
+        self.wake_event.set()
+
+
+async def run_inline(func, *args):
+    """run_blocking stand-in that calls func on the loop thread (simulations)"""
+    return func(*args)
 
 
-class LidLockWindow:
-    """Main window class for handling Windows messages"""
+async def run_power_cycle(power_aware, executor, cycles, time_scale):
+    """
+    One simulated run for benchmark_power_cycle - awake on AC, awake on
+    battery, asleep, wake; a fixed-interval run never hears of power events
+    """
+    loop = asyncio.get_running_loop()
+    state = {'asleep': False, 'woke': None, 'wasted': 0}
+    latencies = []
+    
+    def fake_sampler():
+        # Display enumeration cost, paid on the executor like the real sampler
+        time.sleep(SIMULATED_SAMPLE_COST * time_scale)
+        if state['asleep']:
+            state['wasted'] += 1
+        elif state['woke'] is not None:
+            latencies.append(time.monotonic() - state['woke'])
+            state['woke'] = None
+        return False
+    
+    async def run_blocking(func, *args):
+        return await loop.run_in_executor(executor, func, *args)
+    
+    monitor = LidMonitorPolling(lambda lid_closed: None, run_blocking, sampler=fake_sampler, gate=lambda: True)
+    monitor.poll_interval = POLL_INTERVAL_AC * time_scale
+    task = asyncio.create_task(monitor.run())
+    
+    rates = {'ac': [], 'battery': []}
+    phase_seconds = POLL_INTERVAL_BATTERY * time_scale * 5
+    
+    for cycle in range(cycles):
+        for source in ('ac', 'battery'):
+            if power_aware:
+                monitor.set_power_source(source == 'ac')
+                base = POLL_INTERVAL_AC if source == 'ac' else POLL_INTERVAL_BATTERY
+                monitor.poll_interval = base * time_scale
+            before = monitor.stats['samples']
+            await asyncio.sleep(phase_seconds)
+            rates[source].append((monitor.stats['samples'] - before) / phase_seconds)
+        
+        if power_aware:
+            monitor.suspend()
+        state['asleep'] = True
+        # Real sleep freezes the loop; a simulated one must end before the
+        # lost-resume fallback fires
+        await asyncio.sleep(POLL_INTERVAL_AC * time_scale * (SUSPEND_FALLBACK_POLLS - 1))
+        state['asleep'] = False
+        state['woke'] = time.monotonic()
+        if power_aware:
+            monitor.resume()
+            monitor.resume()  # PBT_APMRESUMEAUTOMATIC + PBT_APMRESUMESUSPEND
+        # Long enough for a fixed-interval poll to come round
+        await asyncio.sleep(POLL_INTERVAL_AC * time_scale * 1.5)
+    
+    monitor.stop()
+    await task
+    
+    # Scale back to real intervals
+    latencies_ms = [latency / time_scale * 1000 for latency in latencies] or [0.0]
+    return {
+        'samples_while_suspended': state['wasted'],
+        'resume_latency_ms_avg': sum(latencies_ms) / len(latencies_ms),
+        'resume_latency_ms_max': max(latencies_ms),
+        'ac_samples_per_second': sum(rates['ac']) / len(rates['ac']) * time_scale,
+        'battery_samples_per_second': sum(rates['battery']) / len(rates['battery']) * time_scale,
+    }
+
+
+async def benchmark_power_cycle(cycles=3, time_scale=0.05):
+    """
+    Simulated suspend/resume benchmark - the power-aware monitor next to a
+    fixed-interval baseline that ignores power events (the old poller)
+    Samples go through a real executor with a simulated enumeration cost;
+    the run is time_scale times faster and results are scaled back
+    """
+    executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="LidLock-bench")
+    try:
+        results = {
+            'fixed_interval': await run_power_cycle(False, executor, cycles, time_scale),
+            'power_aware': await run_power_cycle(True, executor, cycles, time_scale),
+        }
+    finally:
+        executor.shutdown()
+    
+    print(f"{'metric':<30}{'fixed interval':>16}{'power aware':>14}")
+    for name in results['power_aware']:
+        print(f"{name:<30}{results['fixed_interval'][name]:>16.2f}{results['power_aware'][name]:>14.2f}")
+    return results
+
+
+def try_acquire_engine_mutex():
+    """
+    Try to become the machine-wide detection engine
+    Returns: mutex handle if this process owns the engine role, None otherwise
+    """
+    try:
+        mutex = win32event.CreateMutex(None, False, ENGINE_IDENTIFIER)
+        if win32api.GetLastError() == winerror.ERROR_ALREADY_EXISTS:
+            # Release our handle so the mutex dies with the current engine
+            win32api.CloseHandle(mutex)
+            return None
+        return mutex
+    except Exception as e:
+        # ERROR_ACCESS_DENIED - the engine runs in another user's session
+        logging.debug(f"Detection engine owned by another session: {e}")
+        return None
+
+
+class LocalAgentClient:
+    """Connection from the engine to its session's lock agent - fed directly on the loop"""
     
     def __init__(self):
+        self.reader = asyncio.StreamReader()
+    
+    def send(self, message):
+        self.reader.feed_data(message)
+        return True
+    
+    def close(self):
+        self.reader.feed_eof()
+
+
+class DetectionEngine:
+    """
+    Machine-wide detection engine - only one runs per machine, always in the
+    console session (display enumeration only sees the caller's own desktop)
+    Samples the hardware once and hands lid state to the console session's lock agent
+    """
+    
+    def __init__(self, mutex, session_id, run_blocking, on_background):
+        self.mutex = mutex
+        self.session_id = session_id
+        self.run_blocking = run_blocking
+        self.on_background = on_background
+        self.clients = set()
+        self.last_state = None
+        self.topology = TopologyTracker()
+        self.monitor = LidMonitorPolling(
+            self.publish,
+            run_blocking,
+            sampler=self.topology.sample,
+            gate=self.on_console,
+            on_gate_closed=self.left_console
+        )
+        self.monitor_task = None
+    
+    async def start(self):
+        await self.update_power_source()
+        self.monitor_task = asyncio.create_task(self.monitor.run())
+        logging.info(f"✅ Detection engine started in session {self.session_id}")
+    
+    async def stop(self):
+        """Give up the engine role - stop sampling, drop agents, release the mutex"""
+        self.monitor.stop()
+        self.last_state = None
+        for client in list(self.clients):
+            client.close()
+        self.clients.clear()
+        if self.mutex is not None:
+            await self.run_blocking(win32api.CloseHandle, self.mutex)
+        logging.info(f"Detection engine stopped in session {self.session_id}")
+    
+    def on_console(self):
+        """Sampling gate (executor thread) - only sample while this session owns the console"""
+        return is_console_session(self.session_id)
+    
+    def left_console(self):
+        # A background desktop reports no displays - never publish or replay that
+        self.last_state = None
+        self.on_background()
+    
+    def add_agent(self, client):
+        self.clients.add(client)
+        logging.info(f"Lock agent connected ({len(self.clients)} agent(s))")
+        
+        # Bring late joiners up to date - only with state this engine sampled itself
+        if self.last_state is not None:
+            self.send(client, encode_state_message(self.last_state, self.topology.last_events))
+    
+    def connect_local(self):
+        """Connection for the lock agent of the engine's session"""
+        client = LocalAgentClient()
+        self.add_agent(client)
+        return client.reader, client.close
+    
+    async def update_power_source(self):
+        """Match the sampling budget to the current AC/battery state"""
+        battery = await self.run_blocking(get_battery_status)
+        if battery and battery.get('battery_present'):
+            self.monitor.set_power_source(battery['ac_online'])
+    
+    def publish(self, lid_closed):
+        """Fan a lid state change out to all connected lock agents"""
+        self.last_state = lid_closed
+        message = encode_state_message(lid_closed, self.topology.last_events)
+        
+        logging.info(f"Publishing lid state {lid_closed} to {len(self.clients)} agent(s)")
+        for client in list(self.clients):
+            self.send(client, message)
+    
+    def send(self, client, message):
+        if not client.send(message):
+            self.clients.discard(client)
+            client.close()
+
+
+def encode_state_message(lid_closed, events=()):
+    """Encode a lid state update and the topology events behind it as one JSON line"""
+    return (json.dumps({"lid_closed": lid_closed, "events": list(events)}) + "\n").encode("utf-8")
+
+
+class SessionLockAgent:
+    """
+    Per-session lock agent - one runs in every logged-on session
+    Receives lid state from the detection engine while its session owns the
+    console and locks only its own session
+    """
+    
+    def __init__(self, session_id, lock_callback, connect, on_engine_lost, run_blocking):
+        self.session_id = session_id
+        self.lock_callback = lock_callback
+        self.connect = connect
+        self.on_engine_lost = on_engine_lost
+        self.run_blocking = run_blocking
+        self.running = True
+        self.last_state = None
+        self.pending_lock = None
+    
+    async def run(self):
+        logging.info(f"✅ Starting lock agent for session {self.session_id}")
+        
+        while self.running:
+            try:
+                reader, close = await self.connect()
+                logging.info("Connected to detection engine")
+                try:
+                    while True:
+                        line = await reader.readline()
+                        if not line:
+                            break
+                        await self.handle_message(json.loads(line))
+                finally:
+                    close()
+                logging.warning("Detection engine disconnected")
+            except Exception as e:
+                logging.warning(f"Detection engine unavailable: {e}")
+            
+            self.last_state = None
+            if self.running:
+                # Wait until this session can run the engine again
+                await self.on_engine_lost()
+    
+    async def handle_message(self, message):
+        lid_closed = message.get("lid_closed")
+        if lid_closed is None:
+            return
+        
+        if lid_closed == self.last_state:
+            return
+        
+        self.last_state = lid_closed
+        if not lid_closed:
+            # Debounce - reopening the lid inside the grace delay cancels the lock
+            if self.pending_lock and not self.pending_lock.done():
+                self.pending_lock.cancel()
+                logging.info("Lid reopened during grace delay - lock cancelled")
+            return
+        
+        if not await self.run_blocking(is_console_session, self.session_id):
+            logging.debug(f"Session {self.session_id} is not on the console - ignoring lid close")
+            return
+        
+        if not await self.run_blocking(is_session_locked, self.session_id):
+            logging.info(f"🔒 Lid closed detected via polling ({', '.join(message.get('events', [])) or 'initial state'}) - triggering lock")
+            print("🔒 Lid closed - locking workstation!")
+            self.pending_lock = asyncio.create_task(self.lock_callback())
+    
+    def stop(self):
+        self.running = False
+
+
+class LidLockWindow(threading.Thread):
+    """
+    Win32 message pump bridge - owns the hidden window on its own thread
+    and posts power broadcasts into the runtime loop
+    """
+    
+    def __init__(self, runtime):
+        super().__init__(daemon=True)
+        self.runtime = runtime
         self.hwnd = None
-        self.last_lid_state = None
-        self.lock_delay_timer = None
-        self.polling_thread = None
         self.power_api_working = False
-        
-        self.create_window()
-        self.start_polling_monitor()
     
     def create_window(self):
-        """Create a message-only window"""
+        """Create a hidden top-level window (message-only windows miss power broadcasts)"""
         try:
             wc = win32gui.WNDCLASS()
             wc.hInstance = win32api.GetModuleHandle(None)
             wc.lpszClassName = APP_NAME
-            
-            def simple_wndproc(hwnd, msg, wparam, lparam):
-                return 0
-            
-            wc.lpfnWndProc = simple_wndproc
+            wc.lpfnWndProc = self.wndproc
             
             try:
                 win32gui.RegisterClass(wc)
@@ -348,7 +1319,7 @@ class LidLockWindow:
                 None,
                 0,
                 0, 0, 0, 0,
-                win32con.HWND_MESSAGE,
+                0,
                 0,
                 wc.hInstance,
                 None
@@ -359,48 +1330,237 @@ class LidLockWindow:
             
             logging.info(f"Message window created successfully (HWND: {self.hwnd})")
             
+            # Console connect/disconnect decides which session runs the engine
+            win32ts.WTSRegisterSessionNotification(self.hwnd, win32ts.NOTIFY_FOR_THIS_SESSION)
+            
         except Exception as e:
             logging.error(f"Error creating window: {e}")
             logging.error(traceback.format_exc())
     
-    def start_polling_monitor(self):
-        """Start the polling-based monitor"""
+    def wndproc(self, hwnd, msg, wparam, lparam):
+        """Forward power broadcasts and session changes to the runtime loop"""
+        if msg == win32con.WM_POWERBROADCAST:
+            self.power_api_working = True
+            if wparam == win32con.PBT_APMSUSPEND:
+                self.runtime.post(self.runtime.on_suspend)
+            elif wparam in (win32con.PBT_APMRESUMEAUTOMATIC, win32con.PBT_APMRESUMESUSPEND):
+                self.runtime.post(self.runtime.on_resume)
+            elif wparam == win32con.PBT_APMPOWERSTATUSCHANGE:
+                self.runtime.post(self.runtime.on_power_status_change)
+            return True
+        if msg == win32con.WM_WTSSESSION_CHANGE:
+            if wparam in (win32con.WTS_CONSOLE_CONNECT, win32con.WTS_CONSOLE_DISCONNECT,
+                          win32con.WTS_SESSION_LOGON, win32con.WTS_SESSION_UNLOCK):
+                self.runtime.post(self.runtime.on_session_change)
+            return 0
+        return win32gui.DefWindowProc(hwnd, msg, wparam, lparam)
+    
+    def run(self):
+        """Create the window and pump its messages (both must happen on this thread)"""
+        self.create_window()
         try:
-            self.polling_thread = LidMonitorPolling(self.on_lid_closed_detected)
-            self.polling_thread.start()
-            logging.info("✅ Polling monitor started (primary method for virtualization)")
-            print("✅ LidLock started - using polling method (virtualization-compatible)")
+            win32gui.PumpMessages()
         except Exception as e:
-            logging.error(f"Failed to start polling monitor: {e}")
+            logging.error(f"Error in message pump: {e}")
+            logging.error(traceback.format_exc())
+
+
+class LidLockRuntime:
+    """
+    Asyncio core - owns detection sampling, grace-delay lock timers, debouncing
+    and notification dispatch as coroutines on one event loop
+    Blocking Win32 calls go through a single executor worker; the message pump
+    and the tray icon are bridge threads that post into the loop
+    """
     
-    def on_lid_closed_detected(self):
-        """Callback when lid closure is detected"""
-        try:
-            displays = display_count()
-            logging.info(f"Lid closure callback - Display count: {displays}")
+    def __init__(self):
+        self.loop = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=EXECUTOR_WORKERS,
+            thread_name_prefix="LidLock-win32"
+        )
+        self.session_id = get_current_session_id()
+        self.engine = None
+        self.engine_lock = None
+        self.console_changed = None
+        self.agent = None
+        self.window = None
+        self.notifications = None
+        self.settings_thread = None
+    
+    async def run_blocking(self, func, *args):
+        """Run a blocking Win32 call on the bounded executor"""
+        return await self.loop.run_in_executor(self.executor, func, *args)
+    
+    def post(self, func, *args):
+        """Schedule a callback on the loop - safe to call from bridge threads"""
+        self.loop.call_soon_threadsafe(func, *args)
+    
+    def submit(self, coro):
+        """Run a coroutine on the loop - safe to call from bridge threads"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    async def run(self):
+        """Start every component and run until the process exits"""
+        self.loop = asyncio.get_running_loop()
+        self.engine_lock = asyncio.Lock()
+        self.console_changed = asyncio.Event()
+        self.notifications = asyncio.Queue()
+        
+        self.window = LidLockWindow(self)
+        self.window.start()
+        create_tray_icon(self)
+        self.notify(
+            "LidLock",
+            f"✅ Running (v{VERSION})\nAuto-cleaning logs enabled\nPolling every {POLL_INTERVAL_AC} seconds"
+        )
+        
+        await self.start_detection_engine()
+        self.agent = SessionLockAgent(
+            self.session_id,
+            self.lock_session,
+            self.connect_engine,
+            self.wait_for_engine_role,
+            self.run_blocking
+        )
+        
+        logging.info("=" * 60)
+        logging.info("DETECTION METHODS:")
+        logging.info("1. ✅ Polling-based monitor (PRIMARY - always active)")
+        logging.info(f"   Session {self.session_id} - detection engine: "
+                     f"{'this session' if self.engine else 'another session'}")
+        logging.info("2. ✅ Suspend/resume + AC/battery notifications (WM_POWERBROADCAST)")
+        logging.info("3. ⚠️ Power setting notifications (DISABLED - Python 3.13)")
+        logging.info("=" * 60)
+        logging.info("📁 Log location: " + log_path)
+        logging.info("🗑️  Logs auto-delete after 24 hours or on Windows cleanup")
+        
+        await asyncio.gather(self.agent.run(), self.dispatch_notifications())
+    
+    async def start_detection_engine(self):
+        """Start the machine-wide detection engine if this session owns the console"""
+        async with self.engine_lock:
+            if self.engine is not None:
+                return
+            
+            if not await self.run_blocking(is_console_session, self.session_id):
+                logging.debug("Not on the console - leaving the detection engine to the console session")
+                return
+            
+            mutex = await self.run_blocking(try_acquire_engine_mutex)
+            if mutex is None:
+                logging.info("Detection engine already running in another session")
+                return
             
-            if displays == 0 and not is_session_locked():
-                threading.Timer(0.5, lock_workstation).start()
+            try:
+                engine = DetectionEngine(
+                    mutex,
+                    self.session_id,
+                    self.run_blocking,
+                    self.on_engine_background
+                )
+                await engine.start()
+                self.engine = engine
+                logging.info("✅ Polling monitor started (primary method for virtualization)")
+                print("✅ LidLock started - using polling method (virtualization-compatible)")
+            except Exception as e:
+                logging.error(f"Failed to start detection engine: {e}")
+                win32api.CloseHandle(mutex)
+    
+    async def stop_detection_engine(self):
+        """Hand the engine role over - this session no longer owns the console"""
+        async with self.engine_lock:
+            engine, self.engine = self.engine, None
+            if engine is not None:
+                logging.info("Session left the console - handing the detection engine over")
+                await engine.stop()
+    
+    async def connect_engine(self):
+        """Connect the lock agent to this session's engine, starting it if we own the console"""
+        await self.start_detection_engine()
+        if self.engine is None:
+            raise ConnectionError("this session is not running the detection engine")
+        return self.engine.connect_local()
+    
+    async def wait_for_engine_role(self):
+        """
+        The agent lost its engine - on the console, retry once the previous
+        owner had time to release the mutex; in the background, wait for the
+        console to come back instead of polling
+        """
+        self.console_changed.clear()
+        if await self.run_blocking(is_console_session, self.session_id):
+            await asyncio.sleep(ENGINE_RECONNECT_DELAY)
+        else:
+            await self.console_changed.wait()
+    
+    def on_engine_background(self):
+        """Our engine found its session off the console"""
+        self.loop.create_task(self.stop_detection_engine())
+    
+    def on_session_change(self):
+        """Console connect/disconnect, logon or unlock - re-decide the engine role"""
+        self.console_changed.set()
+        self.loop.create_task(self.update_engine_role())
+    
+    async def update_engine_role(self):
+        if await self.run_blocking(is_console_session, self.session_id):
+            await self.start_detection_engine()
+        else:
+            await self.stop_detection_engine()
+    
+    async def lock_session(self):
+        """
+        Lock after the grace delay - the agent cancels this if the lid reopens first
+        The engine only reports a close when no display is left active, so there
+        is no need to enumerate displays again here
+        """
+        try:
+            await asyncio.sleep(LOCK_GRACE_DELAY)
+            if not await self.run_blocking(is_session_locked, self.session_id):
+                await self.run_blocking(lock_workstation)
             else:
-                logging.info("External displays present or already locked")
+                logging.info("Session already locked")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logging.error(f"Error in lid closed callback: {e}")
     
-    def run(self):
-        """Start the message pump"""
-        try:
-            logging.info("=" * 60)
-            logging.info("DETECTION METHODS:")
-            logging.info("1. ✅ Polling-based monitor (PRIMARY - always active)")
-            logging.info("2. ⚠️ Power API notifications (DISABLED - Python 3.13)")
-            logging.info("=" * 60)
-            logging.info("📁 Log location: " + log_path)
-            logging.info("🗑️  Logs auto-delete after 24 hours or on Windows cleanup")
-            
-            win32gui.PumpMessages()
-        except Exception as e:
-            logging.error(f"Error in message pump: {e}")
-            logging.error(traceback.format_exc())
+    def on_suspend(self):
+        """System is about to sleep or hibernate"""
+        if self.engine:
+            self.engine.monitor.suspend()
+    
+    def on_resume(self):
+        """System woke up from sleep or hibernate"""
+        if self.engine:
+            self.engine.monitor.resume()
+    
+    def on_power_status_change(self):
+        """AC adapter plugged in or removed"""
+        if self.engine:
+            self.loop.create_task(self.engine.update_power_source())
+    
+    def notify(self, title, message):
+        """Queue a toast notification"""
+        self.notifications.put_nowait((title, message))
+    
+    async def dispatch_notifications(self):
+        """Show queued toasts one at a time - the executor is only held while one is created"""
+        while True:
+            title, message = await self.notifications.get()
+            await self.run_blocking(show_notification, title, message)
+            # win10toast drops a toast while another is still up
+            await asyncio.sleep(TOAST_DURATION)
+    
+    def open_settings_window(self):
+        """Open the settings window unless one is already showing"""
+        if self.settings_thread and self.settings_thread.is_alive():
+            logging.info("Settings window already open")
+            return
+        # Tk needs a thread of its own for its mainloop
+        self.settings_thread = threading.Thread(target=open_settings, daemon=True)
+        self.settings_thread.start()
 
 
 def check_autostart_status():
@@ -637,8 +1797,8 @@ def open_settings():
         logging.error(traceback.format_exc())
 
 
-def create_tray_icon():
-    """Create system tray icon"""
+def create_tray_icon(runtime):
+    """Create system tray icon (pystray runs its own loop on a bridge thread)"""
     try:
         def quit_app(icon, item):
             logging.info("Application shutting down via tray")
@@ -646,11 +1806,19 @@ def create_tray_icon():
             os._exit(0)
         
         def open_settings_from_tray(icon, item):
-            threading.Thread(target=open_settings, daemon=True).start()
+            runtime.post(runtime.open_settings_window)
+        
+        def toggle_profiling(icon, item):
+            if PROFILER.enabled:
+                PROFILER.disable()
+            else:
+                PROFILER.enable()
         
         menu = Menu(
             MenuItem('Settings', open_settings_from_tray),
-            MenuItem('Test Lock', lambda i, itm: lock_workstation()),
+            MenuItem('Test Lock', lambda i, itm: runtime.submit(runtime.run_blocking(lock_workstation))),
+            MenuItem('Profiling', toggle_profiling, checked=lambda item: PROFILER.enabled),
+            MenuItem('Dump Profile', lambda i, itm: PROFILER.dump()),
             MenuItem('Exit', quit_app)
         )
         
@@ -669,14 +1837,14 @@ def create_tray_icon():
         logging.error(traceback.format_exc())
 
 
-def show_startup_notification():
-    """Show startup notification"""
+def show_notification(title, message):
+    """Show a toast notification - returns at once, win10toast keeps it up on its own thread"""
     try:
         toaster = ToastNotifier()
         toaster.show_toast(
-            "LidLock",
-            f"✅ Running (v{VERSION})\nAuto-cleaning logs enabled\nPolling every 2 seconds",
-            duration=5,
+            title,
+            message,
+            duration=TOAST_DURATION,
             threaded=True,
             icon_path=None
         )
@@ -704,13 +1872,14 @@ def main():
         logging.info(f"Working directory: {os.getcwd()}")
         logging.info(f"Admin privileges: {is_admin()}")
         logging.info(f"WMI Available: {WMI_AVAILABLE}")
+        logging.info(f"Session ID: {get_current_session_id()}")
         logging.info(f"{'='*60}")
         
         mutex = win32event.CreateMutex(None, False, SINGLETON_IDENTIFIER)
         last_error = win32api.GetLastError()
         
         if last_error == winerror.ERROR_ALREADY_EXISTS:
-            logging.warning("Another instance is already running")
+            logging.warning("Another instance is already running in this session")
             print("⚠️  LidLock is already running - check system tray")
             messagebox.showwarning(
                 "LidLock",
@@ -718,13 +1887,13 @@ def main():
             )
             return
         
+        if "--profile" in sys.argv or os.environ.get("LIDLOCK_PROFILE") == "1":
+            PROFILER.enable()
+        
         enabled, _ = check_autostart_status()
         if not enabled:
             set_autostart()
         
-        create_tray_icon()
-        show_startup_notification()
-        
         print("✅ LidLock initialized successfully!")
         print("   - Green tray icon visible")
         print("   - Polling-based detection active")
@@ -732,9 +1901,9 @@ def main():
         print("   - Right-click tray icon for settings")
         print()
         
-        window = LidLockWindow()
-        logging.info("Entering message loop (polling-based detection active)")
-        window.run()
+        runtime = LidLockRuntime()
+        logging.info("Entering event loop (polling-based detection active)")
+        asyncio.run(runtime.run())
         
     except Exception as e:
         logging.error(f"Fatal error in main: {e}")
@@ -748,4 +1917,16 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    if "--benchmark-power" in sys.argv:
+        asyncio.run(benchmark_power_cycle())
+    elif "--record-topology" in sys.argv:
+        record_args = sys.argv[sys.argv.index("--record-topology") + 1:]
+        if record_args:
+            record_dock_trace(*record_args[:2])
+        else:
+            print("Usage: lidlock.py --record-topology <traces.json> [name]")
+    elif "--benchmark-topology" in sys.argv:
+        trace_args = sys.argv[sys.argv.index("--benchmark-topology") + 1:]
+        benchmark_topology_diff(load_dock_traces(trace_args[0]) if trace_args else DOCK_TRACES)
+    else:
+        main()
@@ -0,0 +1,76 @@
+"""
+Test setup - LidLock is Windows-only, so the Win32 and UI modules are replaced
+with empty stand-ins before lidlock is imported; tests patch what they call
+"""
+
+import asyncio
+import ctypes
+import heapq
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+
+os.environ.setdefault('TEMP', tempfile.gettempdir())
+
+for name in ('win32con', 'win32gui', 'win32api', 'win32event', 'win32ts', 'winerror', 'winreg',
+             'pystray', 'PIL', 'win10toast'):
+    if name not in sys.modules:
+        sys.modules[name] = types.ModuleType(name)
+
+sys.modules['pystray'].Icon = sys.modules['pystray'].Menu = sys.modules['pystray'].MenuItem = object
+sys.modules['PIL'].Image = sys.modules['PIL'].ImageDraw = object
+sys.modules['win10toast'].ToastNotifier = object
+
+
+class _NullDLL:
+    """Every Win32 export returns 0 (failure) unless a test patches it"""
+    
+    def __getattr__(self, name):
+        return lambda *args: 0
+
+
+if not hasattr(ctypes, 'WinDLL'):
+    ctypes.WinDLL = lambda *args, **kwargs: _NullDLL()
+    ctypes.windll = _NullDLL()
+
+win32ts = sys.modules['win32ts']
+win32ts.ProcessIdToSessionId = lambda pid: 1
+win32ts.WTSGetActiveConsoleSessionId = lambda: 1
+win32ts.WTSQuerySessionInformation = lambda *args: 0
+win32ts.WTS_CURRENT_SERVER_HANDLE = 0
+win32ts.WTSSessionInfo = 0
+win32ts.WTSLocked = 1
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop on simulated time - with nothing ready it jumps to the next timer"""
+    
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+    
+    def time(self):
+        return self.now
+    
+    def _run_once(self):
+        # Drop cancelled timers first so the jump lands on one that will run
+        while self._scheduled and self._scheduled[0].cancelled():
+            heapq.heappop(self._scheduled)
+            self._timer_cancelled_count -= 1
+        if not self._ready and self._scheduled:
+            self.now = max(self.now, self._scheduled[0].when())
+        super()._run_once()
+
+
+@pytest.fixture
+def run_virtual():
+    """Run a coroutine to completion on a VirtualClockLoop"""
+    def run(coro):
+        with asyncio.Runner(loop_factory=VirtualClockLoop) as runner:
+            return runner.run(coro)
+    return run
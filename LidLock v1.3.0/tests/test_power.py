@@ -0,0 +1,139 @@
+"""Suspend/resume scheduling of the polling monitor, on a virtual clock"""
+
+import asyncio
+
+import lidlock
+
+
+class Lid:
+    """Simulated lid - records the loop time of every sample"""
+    
+    def __init__(self):
+        self.closed = False
+        self.sampled_at = []
+    
+    def sample(self):
+        self.sampled_at.append(asyncio.get_running_loop().time())
+        return self.closed
+
+
+def start_monitor(lid, gate=None, on_gate_closed=None):
+    changes = []
+    monitor = lidlock.LidMonitorPolling(
+        changes.append, lidlock.run_inline, sampler=lid.sample, gate=gate, on_gate_closed=on_gate_closed
+    )
+    return monitor, changes, asyncio.create_task(monitor.run())
+
+
+async def stop_monitor(monitor, task):
+    monitor.stop()
+    await task
+
+
+def test_no_sampling_while_suspended_and_immediate_resume_sample(run_virtual):
+    async def scenario():
+        lid = Lid()
+        monitor, changes, task = start_monitor(lid)
+        await asyncio.sleep(1)
+        
+        monitor.suspend()
+        lid.closed = True
+        await asyncio.sleep(5)
+        assert lid.sampled_at == [0]
+        
+        monitor.resume()
+        await asyncio.sleep(lidlock.RESUME_SETTLE_DELAY + 0.1)
+        # Sampled at the moment of resume, then a closed reading is confirmed once
+        assert lid.sampled_at == [0, 6, 6 + lidlock.RESUME_SETTLE_DELAY]
+        assert changes == [False, True]
+        
+        await stop_monitor(monitor, task)
+    
+    run_virtual(scenario())
+
+
+def test_duplicate_resume_broadcast_is_ignored(run_virtual):
+    async def scenario():
+        lid = Lid()
+        monitor, changes, task = start_monitor(lid)
+        await asyncio.sleep(1)
+        
+        monitor.suspend()
+        await asyncio.sleep(1)
+        monitor.resume()
+        monitor.resume()
+        await asyncio.sleep(0.1)
+        assert monitor.stats['resumes'] == 1
+        assert monitor.stats['suspends'] == 1
+        assert lid.sampled_at == [0, 2]
+        
+        monitor.resume()
+        assert monitor.stats['resumes'] == 1
+        
+        await stop_monitor(monitor, task)
+    
+    run_virtual(scenario())
+
+
+def test_lost_resume_broadcast_falls_back_to_sampling(run_virtual):
+    async def scenario():
+        lid = Lid()
+        monitor, changes, task = start_monitor(lid)
+        await asyncio.sleep(1)
+        
+        monitor.suspend()
+        lid.closed = True
+        # No resume() - sampling restarts after a few poll intervals
+        fallback = 1 + lidlock.POLL_INTERVAL_AC * lidlock.SUSPEND_FALLBACK_POLLS
+        await asyncio.sleep(fallback + lidlock.RESUME_SETTLE_DELAY)
+        assert not monitor.suspended
+        assert monitor.stats['resumes'] == 1
+        assert lid.sampled_at == [0, fallback, fallback + lidlock.RESUME_SETTLE_DELAY]
+        assert changes == [False, True]
+        
+        await stop_monitor(monitor, task)
+    
+    run_virtual(scenario())
+
+
+def test_battery_slows_sampling(run_virtual):
+    async def scenario():
+        lid = Lid()
+        monitor, changes, task = start_monitor(lid)
+        await asyncio.sleep(1)
+        
+        monitor.set_power_source(False)
+        await asyncio.sleep(2 * lidlock.POLL_INTERVAL_BATTERY + 0.1)
+        assert lid.sampled_at == [0, 1, 1 + lidlock.POLL_INTERVAL_BATTERY, 1 + 2 * lidlock.POLL_INTERVAL_BATTERY]
+        assert monitor.stats['battery_samples'] == 3
+        
+        await stop_monitor(monitor, task)
+    
+    run_virtual(scenario())
+
+
+def test_closed_gate_skips_the_sample(run_virtual):
+    async def scenario():
+        lid = Lid()
+        on_console = [True]
+        left = []
+        monitor, changes, task = start_monitor(lid, gate=lambda: on_console[0], on_gate_closed=lambda: left.append(1))
+        await asyncio.sleep(1)
+        
+        on_console[0] = False
+        lid.closed = True
+        await asyncio.sleep(2 * lidlock.POLL_INTERVAL_AC)
+        assert lid.sampled_at == [0]
+        assert changes == [False]
+        assert len(left) == 2
+        
+        await stop_monitor(monitor, task)
+    
+    run_virtual(scenario())
+
+
+def test_power_benchmark_compares_against_fixed_interval():
+    results = asyncio.run(lidlock.benchmark_power_cycle(cycles=1, time_scale=0.01))
+    assert set(results) == {'fixed_interval', 'power_aware'}
+    assert results['power_aware']['samples_while_suspended'] == 0
+    assert results['fixed_interval']['samples_while_suspended'] > 0
@@ -0,0 +1,93 @@
+"""Profiler - decorator timing, logging hook, report percentiles and dump files"""
+
+import logging
+import pstats
+
+import pytest
+
+import lidlock
+
+
+@pytest.fixture
+def profiler(monkeypatch, tmp_path):
+    """A fresh global PROFILER writing into a temporary log folder"""
+    profiler = lidlock.Profiler()
+    monkeypatch.setattr(lidlock, 'PROFILER', profiler)
+    monkeypatch.setattr(lidlock, 'log_dir', str(tmp_path))
+    yield profiler
+    profiler.disable()
+
+
+def test_disabled_profiler_records_nothing(profiler):
+    timed = lidlock.profiled(lambda: 42, name="timed")
+    assert timed() == 42
+    assert profiler.run(lambda value: value, 7) == 7
+    assert profiler.stats == {}
+
+
+def test_enable_hooks_logging_and_disable_removes_the_hook(profiler):
+    root = logging.getLogger()
+    assert "handle" not in vars(root)
+    
+    profiler.enable()
+    assert "handle" in vars(root)
+    logging.warning("profiled record")
+    assert profiler.stats["logging"]['calls'] >= 1
+    
+    profiler.disable()
+    assert "handle" not in vars(root)
+    calls = profiler.stats["logging"]['calls']
+    logging.warning("unprofiled record")
+    assert profiler.stats["logging"]['calls'] == calls
+
+
+def test_profiled_calls_are_counted(profiler):
+    @lidlock.profiled
+    def enumerate_displays():
+        return "ok"
+    
+    profiler.enable()
+    for _ in range(3):
+        enumerate_displays()
+    assert profiler.stats["enumerate_displays"]['calls'] == 3
+    assert profiler.stats["enumerate_displays"]['total'] >= 0
+
+
+def test_report_percentiles(profiler):
+    for ms in range(1, 101):
+        profiler.record("sample", ms / 1000)
+    
+    header, line = profiler.report().splitlines()
+    assert header.split() == ["function", "calls", "total", "mean", "p50", "p95", "p99"]
+    name, calls, total, mean, p50, p95, p99 = line.split()
+    assert (name, int(calls)) == ("sample", 100)
+    assert float(total) == pytest.approx(5050)
+    assert float(mean) == pytest.approx(50.5)
+    assert (float(p50), float(p95), float(p99)) == (51, 96, 100)
+
+
+def test_report_keeps_a_bounded_window(profiler):
+    for _ in range(lidlock.PROFILE_SAMPLE_WINDOW + 10):
+        profiler.record("sample", 0.001)
+    assert profiler.stats["sample"]['calls'] == lidlock.PROFILE_SAMPLE_WINDOW + 10
+    assert len(profiler.stats["sample"]['recent']) == lidlock.PROFILE_SAMPLE_WINDOW
+
+
+def test_dump_writes_report_and_pstats(profiler, tmp_path):
+    def sampler():
+        return sum(range(100))
+    
+    profiler.enable()
+    assert profiler.run(sampler) == 4950
+    profiler.record("sample", 0.002)
+    written = profiler.dump()
+    
+    report, capture = sorted(written, key=lambda path: path.endswith(".prof"))
+    assert report.startswith(str(tmp_path)) and report.endswith(".txt")
+    with open(report, encoding="utf-8") as f:
+        text = f.read()
+    assert "Times in milliseconds" in text
+    assert "sample" in text
+    
+    stats = pstats.Stats(capture)
+    assert any(function == "sampler" for _, _, function in stats.stats)
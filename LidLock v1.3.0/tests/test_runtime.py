@@ -0,0 +1,82 @@
+"""LidLockRuntime scheduling - lock timers and toasts on a virtual clock"""
+
+import asyncio
+
+import lidlock
+
+
+def make_runtime():
+    runtime = lidlock.LidLockRuntime()
+    runtime.loop = asyncio.get_running_loop()
+    runtime.notifications = asyncio.Queue()
+    runtime.run_blocking = lidlock.run_inline
+    return runtime
+
+
+def test_queued_toasts_do_not_delay_locking(monkeypatch, run_virtual):
+    shown = []
+    locks = []
+    
+    async def scenario():
+        monkeypatch.setattr(lidlock, 'show_notification', lambda title, message: shown.append(runtime.loop.time()))
+        monkeypatch.setattr(lidlock, 'lock_workstation', lambda: locks.append(runtime.loop.time()))
+        runtime = make_runtime()
+        dispatcher = asyncio.create_task(runtime.dispatch_notifications())
+        
+        for index in range(3):
+            runtime.notify("LidLock", f"toast {index}")
+        await runtime.lock_session()
+        assert locks == [lidlock.LOCK_GRACE_DELAY]
+        
+        await asyncio.sleep(3 * lidlock.TOAST_DURATION)
+        # One toast at a time, each given its full duration
+        assert shown == [0, lidlock.TOAST_DURATION, 2 * lidlock.TOAST_DURATION]
+        dispatcher.cancel()
+    
+    run_virtual(scenario())
+
+
+def test_toasts_do_not_block_the_caller(monkeypatch):
+    calls = []
+    
+    class Toaster:
+        def show_toast(self, *args, **kwargs):
+            calls.append(kwargs)
+    
+    monkeypatch.setattr(lidlock, 'ToastNotifier', Toaster)
+    lidlock.show_notification("LidLock", "hello")
+    assert calls[0]['threaded'] is True
+    assert calls[0]['duration'] == lidlock.TOAST_DURATION
+
+
+def test_lock_timer_cancelled_by_reopen(monkeypatch, run_virtual):
+    locks = []
+    monkeypatch.setattr(lidlock, 'lock_workstation', lambda: locks.append(True))
+    
+    async def scenario():
+        runtime = make_runtime()
+        agent = lidlock.SessionLockAgent(runtime.session_id, runtime.lock_session, None, None, runtime.run_blocking)
+        
+        await agent.handle_message({"lid_closed": True})
+        await asyncio.sleep(lidlock.LOCK_GRACE_DELAY / 2)
+        await agent.handle_message({"lid_closed": False})
+        await asyncio.sleep(lidlock.LOCK_GRACE_DELAY)
+        assert agent.pending_lock.cancelled()
+        assert locks == []
+    
+    run_virtual(scenario())
+
+
+def test_lock_fires_after_grace_delay(monkeypatch, run_virtual):
+    locks = []
+    
+    async def scenario():
+        runtime = make_runtime()
+        monkeypatch.setattr(lidlock, 'lock_workstation', lambda: locks.append(runtime.loop.time()))
+        agent = lidlock.SessionLockAgent(runtime.session_id, runtime.lock_session, None, None, runtime.run_blocking)
+        
+        await agent.handle_message({"lid_closed": True})
+        await asyncio.sleep(2 * lidlock.LOCK_GRACE_DELAY)
+        assert locks == [lidlock.LOCK_GRACE_DELAY]
+    
+    run_virtual(scenario())
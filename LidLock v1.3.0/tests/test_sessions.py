@@ -0,0 +1,206 @@
+"""
+Multi-session simulation - one LidLockRuntime per session sharing a simulated
+machine (console owner, lid, engine mutex), driven on a virtual clock
+"""
+
+import asyncio
+
+import lidlock
+
+
+class Machine:
+    """The shared hardware - console owner, lid, engine mutex and lock log"""
+    
+    def __init__(self, monkeypatch, console=1):
+        self.console = console
+        self.lid_closed = False
+        self.mutex_held = False
+        self.locks = []
+        monkeypatch.setattr(lidlock.win32ts, 'WTSGetActiveConsoleSessionId', lambda: self.console)
+        monkeypatch.setattr(lidlock, 'try_acquire_engine_mutex', self.acquire_mutex)
+        monkeypatch.setattr(lidlock.win32api, 'CloseHandle', self.release_mutex, raising=False)
+        monkeypatch.setattr(lidlock, 'TopologyTracker', lambda: SimulatedTopology(self))
+    
+    def acquire_mutex(self):
+        if self.mutex_held:
+            return None
+        self.mutex_held = True
+        return "engine-mutex"
+    
+    def release_mutex(self, handle):
+        self.mutex_held = False
+
+
+class SimulatedTopology:
+    def __init__(self, machine):
+        self.machine = machine
+        self.last_events = []
+    
+    def sample(self):
+        return self.machine.lid_closed
+
+
+def start_session(machine, session_id, agent=True):
+    """A runtime wired like LidLockRuntime.run, minus window, tray and executor"""
+    runtime = lidlock.LidLockRuntime()
+    runtime.session_id = session_id
+    runtime.loop = asyncio.get_running_loop()
+    runtime.engine_lock = asyncio.Lock()
+    runtime.console_changed = asyncio.Event()
+    runtime.run_blocking = lidlock.run_inline
+    
+    async def lock_session():
+        await asyncio.sleep(lidlock.LOCK_GRACE_DELAY)
+        machine.locks.append(session_id)
+    runtime.lock_session = lock_session
+    
+    runtime.agent = lidlock.SessionLockAgent(
+        session_id,
+        runtime.lock_session,
+        runtime.connect_engine,
+        runtime.wait_for_engine_role,
+        runtime.run_blocking
+    )
+    runtime.agent_task = asyncio.create_task(runtime.agent.run()) if agent else None
+    return runtime
+
+
+def switch_console(machine, session_id, *notified):
+    """Fast user switch - Windows sends a console change to every session listed"""
+    machine.console = session_id
+    for runtime in notified:
+        runtime.on_session_change()
+
+
+async def shutdown(*runtimes):
+    for runtime in runtimes:
+        runtime.agent.stop()
+        await runtime.stop_detection_engine()
+        runtime.console_changed.set()
+    await asyncio.wait_for(
+        asyncio.gather(*(runtime.agent_task for runtime in runtimes if runtime.agent_task)),
+        lidlock.ENGINE_RECONNECT_DELAY + 1
+    )
+
+
+# One poll, then the grace delay
+SETTLE = lidlock.POLL_INTERVAL_AC + lidlock.LOCK_GRACE_DELAY + 0.1
+
+
+def test_only_console_session_locks(monkeypatch, run_virtual):
+    async def scenario():
+        machine = Machine(monkeypatch, console=1)
+        first, second = start_session(machine, 1), start_session(machine, 2)
+        await asyncio.sleep(1)
+        assert first.engine is not None and second.engine is None
+        assert first.agent.last_state is False
+        
+        machine.lid_closed = True
+        await asyncio.sleep(SETTLE)
+        assert machine.locks == [1]
+        # The background session never samples or receives state
+        assert second.agent.last_state is None
+        
+        await shutdown(first, second)
+    
+    run_virtual(scenario())
+
+
+def test_late_joiner_gets_current_state(monkeypatch, run_virtual):
+    async def scenario():
+        machine = Machine(monkeypatch, console=1)
+        runtime = start_session(machine, 1, agent=False)
+        await runtime.start_detection_engine()
+        machine.lid_closed = True
+        await asyncio.sleep(SETTLE)
+        assert runtime.engine.last_state is True
+        
+        runtime.agent_task = asyncio.create_task(runtime.agent.run())
+        await asyncio.sleep(0.01)
+        assert runtime.agent.last_state is True
+        await asyncio.sleep(lidlock.LOCK_GRACE_DELAY + 0.1)
+        assert machine.locks == [1]
+        
+        await shutdown(runtime)
+    
+    run_virtual(scenario())
+
+
+def test_reopen_during_grace_delay_cancels_lock(monkeypatch, run_virtual):
+    # Sample faster than the grace delay so the reopen is seen in time
+    monkeypatch.setattr(lidlock, 'POLL_INTERVAL_AC', lidlock.LOCK_GRACE_DELAY / 5)
+    
+    async def scenario():
+        machine = Machine(monkeypatch, console=1)
+        runtime = start_session(machine, 1)
+        await asyncio.sleep(1)
+        
+        machine.lid_closed = True
+        await asyncio.sleep(lidlock.POLL_INTERVAL_AC)
+        pending = runtime.agent.pending_lock
+        assert pending is not None and not pending.done()
+        
+        machine.lid_closed = False
+        await asyncio.sleep(lidlock.LOCK_GRACE_DELAY)
+        assert pending.cancelled()
+        assert machine.locks == []
+        
+        await shutdown(runtime)
+    
+    run_virtual(scenario())
+
+
+def test_engine_follows_console_session(monkeypatch, run_virtual):
+    async def scenario():
+        machine = Machine(monkeypatch, console=1)
+        first, second = start_session(machine, 1), start_session(machine, 2)
+        await asyncio.sleep(1)
+        old_engine = first.engine
+        
+        switch_console(machine, 2, first, second)
+        await asyncio.sleep(lidlock.ENGINE_RECONNECT_DELAY + 1)
+        assert first.engine is None and second.engine is not None
+        assert old_engine.last_state is None
+        assert first.agent.last_state is None
+        assert second.agent.last_state is False
+        assert machine.locks == []
+        
+        machine.lid_closed = True
+        await asyncio.sleep(SETTLE)
+        assert machine.locks == [2]
+        
+        await shutdown(first, second)
+    
+    run_virtual(scenario())
+
+
+def test_background_engine_hands_over_without_notification(monkeypatch, run_virtual):
+    async def scenario():
+        machine = Machine(monkeypatch, console=1)
+        first, second = start_session(machine, 1), start_session(machine, 2)
+        await asyncio.sleep(1)
+        
+        # The old session misses the switch - its own sampling gate notices,
+        # and the new console session retries until the mutex is free
+        switch_console(machine, 2, second)
+        await asyncio.sleep(lidlock.POLL_INTERVAL_AC + 2 * lidlock.ENGINE_RECONNECT_DELAY + 1)
+        assert first.engine is None and second.engine is not None
+        
+        machine.lid_closed = True
+        await asyncio.sleep(SETTLE)
+        assert machine.locks == [2]
+        
+        await shutdown(first, second)
+    
+    run_virtual(scenario())
+
+
+def test_agent_ignores_lid_close_off_the_console(monkeypatch, run_virtual):
+    async def scenario():
+        machine = Machine(monkeypatch, console=2)
+        runtime = start_session(machine, 1, agent=False)
+        
+        await runtime.agent.handle_message(lidlock.json.loads(lidlock.encode_state_message(True)))
+        assert runtime.agent.pending_lock is None
+    
+    run_virtual(scenario())
@@ -0,0 +1,147 @@
+"""Display topology snapshots, lock decisions and the dock trace benchmark"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import lidlock
+
+ACTIVE = lidlock.DISPLAY_DEVICE_ACTIVE
+PRIMARY = lidlock.DISPLAY_DEVICE_PRIMARY_DEVICE
+PANEL_PATH = "\\\\?\\DISPLAY#LGD05E5#4&2a1c6e0c&0&UID265988#{e6f07b5f-ee97-4a90-b076-33f57bf4eaa7}"
+
+
+def fake_enum(adapters):
+    """EnumDisplayDevices over {adapter: (flags, [(interface path, flags)])}"""
+    names = list(adapters)
+    
+    def enum(device=None, index=0, flags=0):
+        if device is None:
+            if index >= len(names):
+                return SimpleNamespace(DeviceName="")
+            return SimpleNamespace(DeviceName=names[index], StateFlags=adapters[names[index]][0])
+        monitors = adapters[device][1]
+        if index >= len(monitors):
+            return SimpleNamespace(DeviceName="")
+        path, state = monitors[index]
+        return SimpleNamespace(DeviceName=f"{device}\\Monitor{index}", DeviceID=path,
+                               DeviceString="Generic PnP Monitor", StateFlags=state)
+    return enum
+
+
+def test_duplicate_monitor_ids_are_merged(monkeypatch):
+    # Hybrid graphics - the panel is listed under both GPUs, driven by the second
+    monkeypatch.setattr(lidlock.win32api, 'EnumDisplayDevices', fake_enum({
+        "\\\\.\\DISPLAY1": (PRIMARY, [(PANEL_PATH, 0)]),
+        "\\\\.\\DISPLAY2": (ACTIVE, [(PANEL_PATH, ACTIVE)]),
+    }), raising=False)
+    
+    topology = lidlock.get_display_topology()
+    assert list(topology) == ["DISPLAY\\LGD05E5\\4&2A1C6E0C&0&UID265988"]
+    assert topology["DISPLAY\\LGD05E5\\4&2A1C6E0C&0&UID265988"]['active'] is True
+    assert topology["DISPLAY\\LGD05E5\\4&2A1C6E0C&0&UID265988"]['primary'] is True
+
+
+@pytest.mark.parametrize('trace', lidlock.DOCK_TRACES, ids=lambda trace: trace['name'])
+def test_builtin_traces_replay_to_their_labels(trace):
+    results = lidlock.replay_trace(trace)
+    assert [lid_closed for lid_closed, _ in results] == [step['lid_closed'] for step in trace['steps']]
+    assert [sorted(events) for _, events in results] == [sorted(step['events']) for step in trace['steps']]
+
+
+def test_empty_wmi_answer_falls_back_to_the_primary_adapter():
+    # Started docked with the lid closed - WMI has nothing to say about the panel
+    external = lidlock.DOCK_EXTERNAL_1
+    snapshots = iter([
+        lidlock.trace_snapshot(None, [external]),
+        lidlock.trace_snapshot(True, [external]),
+        lidlock.trace_snapshot(True),
+        lidlock.trace_snapshot(False),
+    ])
+    tracker = lidlock.TopologyTracker(lambda: next(snapshots), lambda: set(), lambda: None)
+    
+    assert [tracker.sample() for _ in range(4)] == [False, False, False, True]
+    assert tracker.internal_ids == {lidlock.DOCK_INTERNAL}
+    assert tracker.last_events == [lidlock.TOPOLOGY_INTERNAL_OFF]
+
+
+def test_clamshell_does_not_lock_until_the_last_monitor_goes():
+    internal = lidlock.DOCK_INTERNAL
+    external = lidlock.DOCK_EXTERNAL_1
+    snapshots = iter([
+        lidlock.trace_snapshot(True, [external]),
+        lidlock.trace_snapshot(False, [external]),
+        lidlock.trace_snapshot(False),
+    ])
+    tracker = lidlock.TopologyTracker(lambda: next(snapshots), lambda: {internal}, lambda: None)
+    
+    assert tracker.sample() is False
+    assert tracker.sample() is False
+    assert tracker.last_events == [lidlock.TOPOLOGY_INTERNAL_OFF]
+    assert tracker.sample() is True
+    assert tracker.last_events == [lidlock.TOPOLOGY_EXTERNAL_REMOVED]
+
+
+def test_internal_panel_lookup_reruns_when_a_monitor_appears():
+    calls = []
+    answers = iter([set(), {lidlock.DOCK_INTERNAL}])
+    snapshots = iter([
+        lidlock.trace_snapshot(None, [lidlock.DOCK_EXTERNAL_1]),
+        lidlock.trace_snapshot(None, [lidlock.DOCK_EXTERNAL_1]),
+        lidlock.trace_snapshot(True, [lidlock.DOCK_EXTERNAL_1]),
+        lidlock.trace_snapshot(True, [lidlock.DOCK_EXTERNAL_1]),
+    ])
+    
+    def internal_source():
+        calls.append(1)
+        return next(answers)
+    
+    tracker = lidlock.TopologyTracker(lambda: next(snapshots), internal_source, lambda: None)
+    for _ in range(4):
+        tracker.sample()
+    assert calls == [1, 1]
+    assert tracker.internal_ids == {lidlock.DOCK_INTERNAL}
+
+
+@pytest.mark.parametrize('battery, locks', [
+    ({'ac_online': True, 'battery_percent': 255, 'battery_present': False}, False),
+    ({'ac_online': True, 'battery_percent': 80, 'battery_present': True}, True),
+    (None, True),
+])
+def test_only_a_missing_battery_means_desktop(battery, locks):
+    snapshots = iter([
+        lidlock.trace_snapshot(None, [lidlock.DOCK_EXTERNAL_1]),
+        lidlock.trace_snapshot(None),
+    ])
+    tracker = lidlock.TopologyTracker(lambda: next(snapshots), lambda: None, lambda: battery)
+    
+    assert tracker.sample() is False
+    assert tracker.sample() is locks
+
+
+def test_benchmark_handles_empty_and_short_traces():
+    assert lidlock.benchmark_topology_diff([], repeat=1)['decision_accuracy_percent'] is None
+    results = lidlock.benchmark_topology_diff([
+        {'name': "empty", 'steps': []},
+        {'name': "one step", 'steps': [{'snapshot': lidlock.trace_snapshot(True)}]},
+    ], repeat=1)
+    assert results['traces'] == 1
+    assert results['decisions'] == 0
+
+
+def test_benchmark_scores_wrong_labels():
+    trace = {'name': "mislabelled", 'internal_ids': None, 'steps': [
+        {'snapshot': lidlock.trace_snapshot(True), 'lid_closed': True},
+        {'snapshot': lidlock.trace_snapshot(False), 'lid_closed': True},
+    ]}
+    assert lidlock.benchmark_topology_diff([trace], repeat=1)['decision_accuracy_percent'] == 50
+
+
+def test_topology_sample_is_profiled():
+    tracker = lidlock.TopologyTracker(lidlock.trace_snapshot, lambda: None, lambda: None)
+    lidlock.PROFILER.enable()
+    try:
+        tracker.sample()
+    finally:
+        lidlock.PROFILER.disable()
+    assert "TopologyTracker.sample" in lidlock.PROFILER.stats